@@ -0,0 +1,64 @@
+import unittest
+
+from tests.advantage.helpers import make_subscription
+from webapp.advantage.ua_contracts.builders import build_get_user_info
+
+
+class TestBuilders(unittest.TestCase):
+    def test_build_get_user_info_without_subscription(self):
+        user_summary = {"subscription": None, "renewal_info": None}
+
+        user_info = build_get_user_info(user_summary)
+
+        self.assertEqual(user_info, {"has_monthly_subscription": False})
+
+    def test_build_get_user_info_without_renewal_info(self):
+        subscription = make_subscription()
+        subscription.is_auto_renewing = True
+        user_summary = {"subscription": subscription, "renewal_info": None}
+
+        user_info = build_get_user_info(user_summary)
+
+        expectation = {
+            "has_monthly_subscription": True,
+            "is_auto_renewing": False,
+        }
+
+        self.assertEqual(user_info, expectation)
+
+    def test_build_get_user_info(self):
+        subscription = make_subscription()
+        subscription.is_auto_renewing = True
+        user_summary = {
+            "subscription": subscription,
+            "renewal_info": {
+                "subscriptionStartOfCycle": "2020-01-01T00:00:00Z",
+                "subscriptionEndOfCycle": "2020-02-01T00:00:00Z",
+                "total": 5000,
+                "currency": "usd",
+            },
+        }
+
+        user_info = build_get_user_info(user_summary)
+
+        expectation = {
+            "has_monthly_subscription": True,
+            "is_auto_renewing": True,
+            "last_payment_date": "2020-01-01T00:00:00Z",
+            "next_payment_date": "2020-02-01T00:00:00Z",
+            "total": 5000,
+            "currency": "USD",
+        }
+
+        self.assertEqual(user_info, expectation)
+
+    def test_build_get_user_info_without_currency(self):
+        subscription = make_subscription()
+        user_summary = {
+            "subscription": subscription,
+            "renewal_info": {"total": 5000},
+        }
+
+        user_info = build_get_user_info(user_summary)
+
+        self.assertIsNone(user_info["currency"])
@@ -1,4 +1,5 @@
 import unittest
+from datetime import datetime, timezone
 
 from freezegun import freeze_time
 
@@ -12,7 +13,7 @@ from tests.advantage.helpers import (
     make_legacy_contract_item,
     make_renewal,
 )
-from webapp.advantage.models import Entitlement
+from webapp.advantage.models import Entitlement, UserSubscription
 from webapp.advantage.ua_contracts.helpers import (
     get_items_aggregated_values,
     get_machine_type,
@@ -28,11 +29,13 @@ from webapp.advantage.ua_contracts.helpers import (
     apply_entitlement_rules,
     to_dict,
     group_shop_items,
+    parse_end_dates,
 )
 
 
 class TestHelpers(unittest.TestCase):
     def test_group_shop_items(self):
+        contract = make_shop_contract(id="contract-id-1")
         items = [
             make_contract_item(
                 product_listing_id="listing-id-1", subscription_id="sub-id-1"
@@ -54,7 +57,9 @@ class TestHelpers(unittest.TestCase):
             ),
         ]
 
-        grouped_items = group_shop_items(items=items)
+        grouped_items = group_shop_items(
+            contract_items=[(contract, item) for item in items]
+        )
 
         expected_number_of_groups = 4
         expected_number_of_items_in_first_group = 2
@@ -65,19 +70,19 @@ class TestHelpers(unittest.TestCase):
         self.assertEqual(expected_number_of_groups, len(grouped_items))
         self.assertEqual(
             expected_number_of_items_in_first_group,
-            len(grouped_items["listing-id-1||sub-id-1"]),
+            len(grouped_items[("listing-id-1", "sub-id-1", "contract-id-1")]),
         )
         self.assertEqual(
             expected_number_of_items_in_second_group,
-            len(grouped_items["listing-id-2||sub-id-1"]),
+            len(grouped_items[("listing-id-2", "sub-id-1", "contract-id-1")]),
         )
         self.assertEqual(
             expected_number_of_items_in_third_group,
-            len(grouped_items["listing-id-2||sub-id-2"]),
+            len(grouped_items[("listing-id-2", "sub-id-2", "contract-id-1")]),
         )
         self.assertEqual(
             expected_number_of_items_in_forth_group,
-            len(grouped_items["listing-id-3||sub-id-1"]),
+            len(grouped_items[("listing-id-3", "sub-id-1", "contract-id-1")]),
         )
 
     def test_get_items_aggregated_values(self):
@@ -146,6 +151,30 @@ class TestHelpers(unittest.TestCase):
             expected_end_date,
         )
 
+    def test_parse_end_dates(self):
+        end_dates = [
+            "2020-04-01T00:00:00Z",
+            "2020-04-01T00:00:00Z",
+            "2020-04-02T10:00:00",
+            "Apr 3 2020 10:00 UTC",
+        ]
+
+        parsed_end_dates = parse_end_dates(end_dates)
+
+        self.assertEqual(3, len(parsed_end_dates))
+        self.assertEqual(
+            datetime(2020, 4, 1, tzinfo=timezone.utc),
+            parsed_end_dates["2020-04-01T00:00:00Z"],
+        )
+        self.assertEqual(
+            datetime(2020, 4, 2, 10, tzinfo=timezone.utc),
+            parsed_end_dates["2020-04-02T10:00:00"],
+        )
+        self.assertEqual(
+            datetime(2020, 4, 3, 10, tzinfo=timezone.utc),
+            parsed_end_dates["Apr 3 2020 10:00 UTC"],
+        )
+
     def test_get_price_info_for_shop(self):
         listing = make_listing(price=100, currency="USD")
 
@@ -797,3 +826,30 @@ class TestHelpers(unittest.TestCase):
         self.assertEqual(
             to_dict(final_entitlements), to_dict(expected_entitlements)
         )
+
+    def test_to_dict_with_slots(self):
+        user_subscription = UserSubscription(
+            id="user-subscription-id",
+            account_id="account-id",
+            product_name="product-name",
+            type="yearly",
+            start_date="2020-01-01T00:00:00Z",
+            end_date="2021-01-01T00:00:00Z",
+            number_of_machines=5,
+            machine_type="physical",
+            marketplace="canonical-ua",
+            price=5000,
+            currency="USD",
+            entitlements=[Entitlement(type="cis", enabled_by_default=True)],
+            statuses={"is_expired": False},
+            contract_id="contract-id",
+        )
+
+        data = to_dict(user_subscription)
+
+        self.assertEqual(data["id"], "user-subscription-id")
+        self.assertEqual(data["end_date"], "2021-01-01T00:00:00Z")
+        self.assertEqual(data["entitlements"][0]["type"], "cis")
+        self.assertEqual(data["statuses"], {"is_expired": False})
+        self.assertIsNone(data["renewal_id"])
+        self.assertEqual(len(data), len(UserSubscription.__slots__))
@@ -56,6 +56,27 @@ class Listing:
 
 
 class UserSubscription:
+    __slots__ = (
+        "id",
+        "account_id",
+        "product_name",
+        "type",
+        "start_date",
+        "end_date",
+        "number_of_machines",
+        "machine_type",
+        "marketplace",
+        "price",
+        "currency",
+        "entitlements",
+        "statuses",
+        "period",
+        "subscription_id",
+        "contract_id",
+        "listing_id",
+        "renewal_id",
+    )
+
     def __init__(
         self,
         id: str,
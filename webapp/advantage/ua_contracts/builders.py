@@ -1,11 +1,11 @@
-from datetime import datetime
-from typing import List, Dict, Optional
-
-import pytz
-from dateutil.parser import parse
+from datetime import datetime, timedelta
+from itertools import chain
+from typing import List, Dict, Optional, NamedTuple, Sequence
 
 from webapp.advantage.ua_contracts.helpers import (
+    UTC,
     get_items_aggregated_values,
+    parse_end_dates,
     get_machine_type,
     get_user_subscription_statuses,
     get_price_info,
@@ -22,233 +22,251 @@ from webapp.advantage.ua_contracts.primitives import (
 from webapp.advantage.models import Listing, UserSubscription
 
 
+class ItemGroup(NamedTuple):
+    account: Account
+    contract: Contract
+    items: Sequence[ContractItem]
+    listing: Optional[Listing]
+    marketplace: str
+    subscriptions: List[Subscription]
+    type: str
+    subscription_id: Optional[str] = None
+
+
 def build_user_subscriptions(
     user_summary: List, listings: Dict[str, Listing]
 ) -> List[UserSubscription]:
-    grouped_items = build_initial_user_subscriptions(user_summary, listings)
+    grouped_items = build_all_item_groups(user_summary, listings)
     user_subscriptions = build_final_user_subscriptions(grouped_items)
 
     return user_subscriptions
 
 
-def build_initial_user_subscriptions(
+def build_all_item_groups(
     user_summary: List, listings: Dict[str, Listing]
-) -> List:
-    free_groups = build_free_item_groups(user_summary)
-    trial_groups = build_trial_item_groups(user_summary, listings)
-    shop_groups = build_shop_item_groups(user_summary, listings)
-    legacy_groups = build_legacy_item_groups(user_summary)
-
-    return free_groups + trial_groups + shop_groups + legacy_groups
-
-
-def build_free_item_groups(user_summary: List) -> List:
-    free_item_groups = []
+) -> List[ItemGroup]:
+    free_groups = []
+    trial_groups = []
+    shop_groups = []
+    legacy_groups = []
+    append_trial_group = trial_groups.append
+    append_shop_group = shop_groups.append
+    append_legacy_group = legacy_groups.append
     for user_details in user_summary:
-        contracts: List[Contract] = user_details.get("contracts")
-
-        for contract in contracts:
-            if contract.product_id == "free":
-                free_item_groups.append(
-                    {
-                        "account": user_details.get("account"),
-                        "contract": contract,
-                        "items": contract.items,
-                        "listing": None,
-                        "marketplace": "free",
-                        "subscriptions": user_details.get("subscriptions"),
-                        "type": "free",
-                    }
-                )
-
-    return free_item_groups
-
+        account: Account = user_details["account"]
+        subscriptions: List[Subscription] = user_details["subscriptions"]
+        contracts: List[Contract] = user_details["contracts"]
+        free_contracts = [
+            contract for contract in contracts if contract.product_id == "free"
+        ]
+        # skip contracts without items
+        paid_contracts = [
+            contract
+            for contract in contracts
+            if contract.product_id != "free" and contract.items is not None
+        ]
+        contracts_by_id = {
+            contract.id: contract for contract in paid_contracts
+        }
 
-def build_trial_item_groups(
-    user_summary: List, listings: Dict[str, Listing]
-) -> List:
-    trial_item_groups = []
-    for user_details in user_summary:
-        contracts: List[Contract] = user_details.get("contracts")
+        free_groups.extend(
+            [
+                ItemGroup(
+                    account=account,
+                    contract=contract,
+                    items=contract.items,
+                    listing=None,
+                    marketplace="free",
+                    subscriptions=subscriptions,
+                    type="free",
+                )
+                for contract in free_contracts
+            ]
+        )
 
-        for contract in contracts:
+        shop_items = []
+        append_shop_item = shop_items.append
+        for contract in paid_contracts:
             for item in contract.items:
                 if item.reason == "trial_started":
                     listing = listings[item.product_listing_id]
-                    trial_item_groups.append(
-                        {
-                            "account": user_details.get("account"),
-                            "contract": contract,
-                            "items": [item],
-                            "listing": listing,
-                            "marketplace": listing.marketplace,
-                            "subscriptions": user_details.get("subscriptions"),
-                            "type": "trial",
-                        }
+                    append_trial_group(
+                        ItemGroup(
+                            account=account,
+                            contract=contract,
+                            items=(item,),
+                            listing=listing,
+                            marketplace=listing.marketplace,
+                            subscriptions=subscriptions,
+                            type="trial",
+                        )
                     )
 
-    return trial_item_groups
-
+                if item.renewal is not None:
+                    append_legacy_group(
+                        ItemGroup(
+                            account=account,
+                            contract=contract,
+                            items=(item,),
+                            listing=None,
+                            marketplace="canonical-ua",
+                            subscriptions=subscriptions,
+                            type="legacy",
+                        )
+                    )
 
-def build_shop_item_groups(
-    user_summary: List, listings: Dict[str, Listing]
-) -> List:
-    shop_item_groups = []
-    for user_details in user_summary:
-        contracts: List[Contract] = user_details.get("contracts")
-
-        for contract in contracts:
-            # skip free contracts
-            if contract.product_id == "free":
-                continue
-
-            # skip contracts without items
-            if contract.items is None:
-                continue
-
-            raw_shop_groups = group_shop_items(items=contract.items)
-            for key in raw_shop_groups:
-                key_parts = key.split("||")
-                listing_id = key_parts[0]
-                subscription_id = key_parts[1]
-
-                listing: Listing = listings[listing_id]
-                items: List[ContractItem] = raw_shop_groups[key]
-
-                shop_item_groups.append(
-                    {
-                        "account": user_details.get("account"),
-                        "contract": contract,
-                        "items": items,
-                        "listing": listing,
-                        "subscription_id": subscription_id,
-                        "marketplace": listing.marketplace,
-                        "subscriptions": user_details.get("subscriptions"),
-                        "type": listing.period,
-                    }
+                append_shop_item((contract, item))
+
+        raw_shop_groups = group_shop_items(contract_items=shop_items)
+        for key, items in raw_shop_groups.items():
+            listing_id, subscription_id, contract_id = key
+            listing: Listing = listings[listing_id]
+
+            append_shop_group(
+                ItemGroup(
+                    account=account,
+                    contract=contracts_by_id[contract_id],
+                    items=items,
+                    listing=listing,
+                    subscription_id=subscription_id,
+                    marketplace=listing.marketplace,
+                    subscriptions=subscriptions,
+                    type=listing.period,
                 )
+            )
 
-    return shop_item_groups
-
+    return list(chain(free_groups, trial_groups, shop_groups, legacy_groups))
 
-def build_legacy_item_groups(user_summary: List) -> List:
-    legacy_item_groups = []
-    for user_details in user_summary:
-        contracts: List[Contract] = user_details.get("contracts")
 
-        for contract in contracts:
-            # skip free contracts
-            if contract.product_id == "free":
-                continue
+def build_final_user_subscriptions(
+    grouped_items: List[ItemGroup],
+) -> List[UserSubscription]:
+    free_groups = [group for group in grouped_items if group.type == "free"]
+    paid_groups = [group for group in grouped_items if group.type != "free"]
 
-            # skip contracts without items
-            if contract.items is None:
-                continue
+    user_subscriptions = []
+    append_user_subscription = user_subscriptions.append
+    for group in free_groups:
+        account: Account = group.account
+        contract: Contract = group.contract
+        items: Sequence[ContractItem] = group.items
+        aggregated_values = get_items_aggregated_values(items)
+        number_of_machines = aggregated_values["number_of_machines"]
+        price_info = get_price_info(number_of_machines, items)
 
-            for item in contract.items:
-                if item.renewal is not None:
-                    legacy_item_groups.append(
-                        {
-                            "account": user_details.get("account"),
-                            "contract": contract,
-                            "items": [item],
-                            "listing": None,
-                            "marketplace": "canonical-ua",
-                            "subscriptions": user_details.get("subscriptions"),
-                            "type": "legacy",
-                        }
-                    )
+        user_subscription = UserSubscription(
+            id=make_user_subscription_id(account, "free", contract),
+            type="free",
+            account_id=account.id,
+            entitlements=apply_entitlement_rules(contract.entitlements),
+            start_date=aggregated_values["start_date"],
+            end_date=aggregated_values["end_date"],
+            number_of_machines=number_of_machines,
+            product_name="Free Personal Token",
+            marketplace=group.marketplace,
+            price=price_info["price"],
+            currency=price_info["currency"],
+            machine_type=get_machine_type(contract.product_id),
+            contract_id=contract.id,
+            statuses=get_user_subscription_statuses(type="free"),
+        )
 
-    return legacy_item_groups
+        append_user_subscription(user_subscription)
+
+    expiry_cutoff = datetime.now(tz=UTC) - timedelta(days=30)
+    aggregated_values_list = [
+        get_items_aggregated_values(group.items) for group in paid_groups
+    ]
+    parsed_end_dates = parse_end_dates(
+        [
+            aggregated_values["end_date"]
+            for aggregated_values in aggregated_values_list
+        ]
+    )
+
+    # groups from the same contract share the same entitlements
+    contract_entitlements = {}
+    for group, aggregated_values in zip(paid_groups, aggregated_values_list):
+        account: Account = group.account
+        listing: Listing = group.listing
+        contract: Contract = group.contract
+        subscriptions: List[Subscription] = group.subscriptions
+        items: Sequence[ContractItem] = group.items
+        type = group.type
+        subscription_id = group.subscription_id
+        start_date = aggregated_values["start_date"]
+        end_date = aggregated_values["end_date"]
+        number_of_machines = aggregated_values["number_of_machines"]
 
+        # Do not return expired user subscriptions after 30 days
+        if parsed_end_dates[end_date] < expiry_cutoff:
+            continue
 
-def build_final_user_subscriptions(
-    grouped_items: List,
-) -> List[UserSubscription]:
-    user_subscriptions = []
-    for group in grouped_items:
-        account: Account = group.get("account")
-        listing: Listing = group.get("listing")
-        contract: Contract = group.get("contract")
-        subscriptions: List[Subscription] = group.get("subscriptions")
-        items: List[ContractItem] = group.get("items")
-        type = group.get("type")
-        subscription_id = group.get("subscription_id")
-        aggregated_values = get_items_aggregated_values(items)
-        number_of_machines = aggregated_values.get("number_of_machines")
         price_info = get_price_info(number_of_machines, items, listing)
         renewal = items[0].renewal if type == "legacy" else None
-        product_name = (
-            contract.name if type != "free" else "Free Personal Token"
-        )
+        listing_id = listing.id if listing else None
+        listing_period = listing.period if listing else None
         statuses = get_user_subscription_statuses(
             type=type,
-            end_date=aggregated_values.get("end_date"),
+            end_date=end_date,
             renewal=renewal,
             subscription_id=subscription_id,
             subscriptions=subscriptions or [],
-            listing=listing or None,
+            listing=listing,
         )
 
         id = make_user_subscription_id(
             account, type, contract, renewal, subscription_id
         )
 
+        entitlements = contract_entitlements.get(contract.id)
+        if entitlements is None:
+            entitlements = apply_entitlement_rules(contract.entitlements)
+            contract_entitlements[contract.id] = entitlements
+
         user_subscription = UserSubscription(
             id=id,
             type=type,
             account_id=account.id,
-            entitlements=apply_entitlement_rules(contract.entitlements),
-            start_date=aggregated_values.get("start_date"),
-            end_date=aggregated_values.get("end_date"),
+            entitlements=entitlements,
+            start_date=start_date,
+            end_date=end_date,
             number_of_machines=number_of_machines,
-            product_name=product_name,
-            marketplace=group.get("marketplace"),
-            price=price_info.get("price"),
-            currency=price_info.get("currency"),
+            product_name=contract.name,
+            marketplace=group.marketplace,
+            price=price_info["price"],
+            currency=price_info["currency"],
             machine_type=get_machine_type(contract.product_id),
             contract_id=contract.id,
             subscription_id=subscription_id,
-            listing_id=listing.id if listing else None,
-            period=listing.period if listing else None,
+            listing_id=listing_id,
+            period=listing_period,
             renewal_id=renewal.id if renewal else None,
             statuses=statuses,
         )
 
-        # Do not return expired user subscriptions after 30 days
-        show_user_subscription = True
-        if type != "free":
-            parsed_end_date = parse(user_subscription.end_date)
-            time_now = datetime.utcnow().replace(tzinfo=pytz.utc)
-            delta_till_expiry = parsed_end_date - time_now
-            days_till_expiry = delta_till_expiry.days
-            show_user_subscription = days_till_expiry >= -30
-
-        if show_user_subscription:
-            user_subscriptions.append(user_subscription)
+        append_user_subscription(user_subscription)
 
     return user_subscriptions
 
 
 def build_get_user_info(user_summary: dict = None) -> dict:
     subscription: Optional[Subscription] = user_summary["subscription"]
+    renewal_info = user_summary["renewal_info"]
 
-    if subscription is None:
-        return {"has_monthly_subscription": False}
+    user_info = {"has_monthly_subscription": subscription is not None}
 
-    renewal_info = user_summary["renewal_info"]
+    if subscription is not None:
+        user_info["is_auto_renewing"] = False
 
-    if renewal_info is None:
-        return {
-            "has_monthly_subscription": True,
-            "is_auto_renewing": False,
-        }
+        if renewal_info is not None:
+            user_info["is_auto_renewing"] = subscription.is_auto_renewing
+            currency = renewal_info.get("currency")
+            user_info.update(
+                last_payment_date=renewal_info.get("subscriptionStartOfCycle"),
+                next_payment_date=renewal_info.get("subscriptionEndOfCycle"),
+                total=renewal_info.get("total"),
+                currency=currency.upper() if currency else None,
+            )
 
-    return {
-        "has_monthly_subscription": True,
-        "is_auto_renewing": subscription.is_auto_renewing,
-        "last_payment_date": renewal_info.get("subscriptionStartOfCycle"),
-        "next_payment_date": renewal_info.get("subscriptionEndOfCycle"),
-        "total": renewal_info.get("total"),
-        "currency": renewal_info.get("currency").upper(),
-    }
+    return user_info
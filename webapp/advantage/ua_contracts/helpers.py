@@ -1,7 +1,8 @@
-from datetime import datetime
-from typing import List, Optional, Dict
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List, Optional, Dict, Iterable, Sequence, Tuple
 
-import pytz
+import ciso8601
 from dateutil.parser import parse
 
 from webapp.advantage.models import Listing, Entitlement
@@ -13,12 +14,14 @@ from webapp.advantage.ua_contracts.primitives import (
     Contract,
 )
 
+UTC = timezone.utc
+
 
 def group_shop_items(
-    items: List[ContractItem],
-) -> Dict[str, List[ContractItem]]:
+    contract_items: Iterable[Tuple[Contract, ContractItem]],
+) -> Dict[Tuple[str, str, str], List[ContractItem]]:
     item_groups = {}
-    for item in items:
+    for contract, item in contract_items:
         listing_id = item.product_listing_id
         subscription_id = item.subscription_id
 
@@ -29,7 +32,7 @@ def group_shop_items(
         if item.reason == "trial_started":
             continue
 
-        key = f"{listing_id}||{subscription_id}"
+        key = (listing_id, subscription_id, contract.id)
         item_groups[key] = item_groups.get(key, [])
         item_groups[key].append(item)
 
@@ -37,7 +40,7 @@ def group_shop_items(
 
 
 def get_items_aggregated_values(
-    items: List[ContractItem],
+    items: Sequence[ContractItem],
 ) -> Dict:
     start_date = None
     end_date = None
@@ -69,9 +72,30 @@ def get_items_aggregated_values(
     }
 
 
+def parse_end_dates(end_dates: List[str]) -> Dict[str, datetime]:
+    parsed_end_dates = {}
+    for end_date in end_dates:
+        # contracts often share end dates, parse each one only once
+        if end_date in parsed_end_dates:
+            continue
+
+        try:
+            parsed_end_date = ciso8601.parse_datetime(end_date)
+        except ValueError:
+            # fall back to dateutil for dates that aren't ISO 8601
+            parsed_end_date = parse(end_date)
+
+        if parsed_end_date.tzinfo is None:
+            parsed_end_date = parsed_end_date.replace(tzinfo=UTC)
+
+        parsed_end_dates[end_date] = parsed_end_date
+
+    return parsed_end_dates
+
+
 def get_price_info(
     number_of_machines: int = None,
-    items: List[ContractItem] = None,
+    items: Sequence[ContractItem] = None,
     listing: Listing = None,
 ) -> Dict:
     price_info = {
@@ -95,6 +119,7 @@ def get_price_info(
     return price_info
 
 
+@lru_cache(maxsize=256)
 def get_machine_type(product_id: str) -> Optional[str]:
     if "virtual" in product_id:
         return "virtual"
@@ -181,7 +206,7 @@ def get_user_subscription_statuses(
         if renewal.actionable and renewal.status == "pending":
             start = parse(renewal.start_date)
             end = parse(renewal.end_date)
-            time_now = datetime.utcnow().replace(tzinfo=pytz.utc)
+            time_now = datetime.now(tz=UTC)
             if start <= time_now <= end:
                 statuses["is_renewable"] = True
 
@@ -190,7 +215,7 @@ def get_user_subscription_statuses(
 
 def get_date_statuses(end_date: str) -> dict:
     parsed_end_date = parse(end_date)
-    time_now = datetime.utcnow().replace(tzinfo=pytz.utc)
+    time_now = datetime.now(tz=UTC)
     delta_till_expiry = parsed_end_date - time_now
     days_till_expiry = delta_till_expiry.days
 
@@ -413,11 +438,18 @@ def to_dict(structure, class_key=None):
         for (key, value) in structure.items():
             data[key] = to_dict(value, class_key)
         return data
-    elif hasattr(structure, "__dict__"):
+    elif hasattr(structure, "__dict__") or hasattr(structure, "__slots__"):
+        if hasattr(structure, "__dict__"):
+            attributes = structure.__dict__.items()
+        else:
+            attributes = [
+                (key, getattr(structure, key)) for key in structure.__slots__
+            ]
+
         data = dict(
             [
                 (key, to_dict(value, class_key))
-                for key, value in structure.__dict__.items()
+                for key, value in attributes
                 if not callable(value) and not key.startswith("_")
             ]
         )
@@ -6,7 +6,6 @@ from typing import Optional, List
 
 from dateutil.parser import parse
 import flask
-import pytz
 from flask import g
 from requests.exceptions import HTTPError
 from webargs.fields import String, Boolean
@@ -184,7 +183,7 @@ def advantage_view(**kwargs):
             contract["contractInfo"]["createdAtFormatted"] = format_create
             contract["contractInfo"]["status"] = "active"
 
-            time_now = datetime.utcnow().replace(tzinfo=pytz.utc)
+            time_now = datetime.now(timezone.utc)
 
             if (
                 not new_subscription_start_date